@@ -2,44 +2,64 @@
 from hyperpage import elements
 from hyperpage import markdown
 from hyperpage import display
+from hyperpage import settings
+
+def gen_hints(count, alphabet):
+    """Generate count prefix-free hints over the given alphabet.
+
+    The hints form a balanced code: no hint is more than one key longer than
+    any other, and the shortest hints come first."""
+    if count <= 0:
+        return []
+    hints = ['']
+    offset = 0
+    # repeatedly split the shortest hint into one hint per key
+    while len(hints) - offset < count or len(hints) == 1:
+        prefix = hints[offset]
+        offset += 1
+        hints.extend(prefix + ch for ch in alphabet)
+    return hints[offset:offset+count]
 
 class LinkRegistry:
     """A registry of links in a document."""
     def __init__(self):
         """Initialize an empty registry."""
-        self.reg = {}
-        self.last_uid = ''
+        self.addrs = []
+        self.ids = {}
+        self.hints = {}
+        self.prefixes = set()
 
     def add(self, addr):
         """Add a link.
 
         Addr is the address string (href=addr).
-        Returns a UID string (follow hint) for the link."""
-        # search for if this addr has been linked before
-        for uid in self.reg:
-            if self.reg[uid] == addr:
-                return uid
-        # not linked before
-        uid = self.gen_uid()
-        self.reg[uid] = addr
-        return uid
-
-    def gen_uid(self):
-        """Generate a new UID."""
-        if self.last_uid == '':
-            self.last_uid = 'A'
-        else:
-            tick = self.last_uid[-1]
-            if tick != 'Z':
-                self.last_uid = self.last_uid[:-1] + chr(ord(tick)+1)
-            else:
-                self.last_uid = self.last_uid + 'A'
-        return self.last_uid
+        Returns an integer link ID; links to the same addr share an ID."""
+        if addr not in self.ids:
+            self.ids[addr] = len(self.addrs)
+            self.addrs.append(addr)
+        return self.ids[addr]
+
+    def assign_hints(self, link_ids):
+        """Assign follow hints to the given link IDs, replacing old hints.
 
-    def __getitem__(self, uid):
-        """Get the address associated with the given UID."""
-        if uid in self.reg:
-            return self.reg[uid]
+        Returns a dict mapping each link ID to its hint."""
+        hints = gen_hints(len(link_ids), settings.hint_chars)
+        self.hints = {}
+        self.prefixes = set()
+        for link_id, hint in zip(link_ids, hints):
+            self.hints[hint] = self.addrs[link_id]
+            for end in range(1, len(hint)):
+                self.prefixes.add(hint[:end])
+        return dict(zip(link_ids, hints))
+
+    def is_prefix(self, chain):
+        """Check if chain is the beginning of a longer hint."""
+        return chain in self.prefixes
+
+    def __getitem__(self, hint):
+        """Get the address associated with the given hint."""
+        if hint in self.hints:
+            return self.hints[hint]
         return None
 
 def scroll(fun):
@@ -47,6 +67,7 @@ def scroll(fun):
     def f(self, *args, **kwargs):
         self.update_dims()
         fun(self, *args, **kwargs)
+        self.fill(self.scroll + 2*self.h)
         self.fix_scroll()
         self.draw()
     return f
@@ -56,10 +77,22 @@ class Document:
     def __init__(self):
         """Initialize a totally empty document."""
         self.links = LinkRegistry()
+        self.hinting = False
+        self.idle_key = None
 
-    def hold(self, doc):
-        """Attaches this document to a DocHead."""
+    def hold(self, doc, pending=None):
+        """Attaches this document to a DocHead.
+
+        Pending is an optional iterator of further markdown text, which is
+        parsed into the DocHead as it is scrolled to."""
         self.doc = doc
+        self.pending = pending
+        # parsed pending text as [text, labels, first sub, rows drawn]
+        self.pieces = []
+        # reference-style link definitions seen so far, by key
+        self.defs = {}
+        # undefined link labels -> pieces that mention them
+        self.waiting = {}
         self.scroll = 0
         self.w, self.h = display.get_dims()
         self.mtx = self.doc.draw(self.w)
@@ -70,13 +103,105 @@ class Document:
         w, h = display.get_dims()
         if w != self.w:
             # re-render matrix
-            self.mtx = self.doc.draw(w)
+            self.redraw(w)
 
             # recalculate the scroll value
             self.scroll = self.w*self.scroll//w
             self.fix_scroll()
         self.w = w
         self.h = h
+        self.fill(self.scroll + 2*self.h)
+
+    def fill(self, rows):
+        """Parse pending text until the matrix has at least rows rows.
+
+        If rows is None, parse everything."""
+        while self.pending is not None and \
+              (rows is None or self.mtx.get_h() < rows):
+            chunk = next(self.pending, None)
+            if chunk is None:
+                self.pending = None
+                break
+            text, defs = chunk
+            affected = set()
+            for key, line in defs:
+                self.defs[key] = line
+                affected.update(self.waiting.pop(key, ()))
+            if affected:
+                self.reparse(sorted(affected))
+            labels = markdown.ref_labels(text)
+            start = len(self.doc.subs)
+            self.doc.extend(self.parse_piece(len(self.pieces), text, labels))
+            part = self.doc.draw(self.w, start)
+            self.pieces.append([text, labels, start, part.get_h()])
+            self.mtx += part
+
+    def parse_piece(self, num, text, labels):
+        """Parse piece number num of the pending text.
+
+        Only the link definitions the piece could use are added to it.
+        Labels that are not defined yet are remembered, so the piece can
+        be parsed again once they are."""
+        defs = []
+        for key in labels:
+            if key in self.defs:
+                defs.append(self.defs[key])
+            else:
+                self.waiting.setdefault(key, set()).add(num)
+        return markdown.parse(''.join(defs) + '\n' + text)
+
+    def piece_end(self, num):
+        """Get the index after the last sub of piece number num."""
+        if num+1 < len(self.pieces):
+            return self.pieces[num+1][2]
+        return len(self.doc.subs)
+
+    def reparse(self, nums):
+        """Re-parse the given pieces (sorted numbers) and redraw them.
+
+        Needed when a definition turns up after the links that use it.
+        Only the re-parsed pieces are drawn again; the rows of the pieces
+        after them are moved down or up as needed."""
+        first = nums[0]
+        targets = set(nums)
+        tail_y = self.mtx.get_h() - sum(piece[3]
+                                        for piece in self.pieces[first:])
+        tail = self.mtx.get_rows(tail_y, self.mtx.get_h())
+        rows = []
+        subs = self.doc.subs[:self.pieces[first][2]]
+        y = 0
+        for num in range(first, len(self.pieces)):
+            piece = self.pieces[num]
+            text, labels, start, num_rows = piece
+            end = self.piece_end(num)
+            piece[2] = len(subs)
+            if num in targets:
+                new_subs = self.doc.convert(
+                    self.parse_piece(num, text, labels))
+                piece[3] = 0
+                for sub in new_subs:
+                    part = sub.draw(self.w)
+                    rows += part.get_rows(0, part.get_h())
+                    rows.append([None]*self.w)
+                    piece[3] += part.get_h() + 1
+                subs += new_subs
+            else:
+                subs += self.doc.subs[start:end]
+                rows += tail[y:y+num_rows]
+            y += num_rows
+        self.mtx.set_rows(tail_y, rows)
+        self.doc.subs = subs
+
+    def redraw(self, w):
+        """Redraw the whole matrix at width w."""
+        if not self.pieces:
+            self.mtx = self.doc.draw(w)
+            return
+        self.mtx = self.doc.draw(w, 0, self.pieces[0][2])
+        for num, piece in enumerate(self.pieces):
+            part = self.doc.draw(w, piece[2], self.piece_end(num))
+            piece[3] = part.get_h()
+            self.mtx += part
 
     def draw(self):
         """Draw to screen."""
@@ -87,8 +212,67 @@ class Document:
         if yend > self.mtx.get_h():
             yend = self.mtx.get_h()
         visible_mtx = self.mtx.y_slice(ybegin, yend)
+        put_highlights(visible_mtx)
+        if self.hinting:
+            self.put_hints(visible_mtx)
         display.put(visible_mtx)
 
+    def put_hints(self, mtx):
+        """Assign hints to the links in mtx and write them over the links.
+
+        Each link gets one hint, placed at its first visible character, or
+        moved left as far as needed for the whole hint to fit on the row."""
+        starts = {}
+        for y in range(mtx.get_h()):
+            for x in range(mtx.get_w()):
+                cell = mtx[x, y]
+                if cell is not None and cell.link is not None and \
+                   cell.link not in starts:
+                    starts[cell.link] = (x, y)
+        hints = self.links.assign_hints(list(starts))
+        for link_id, (x, y) in starts.items():
+            hint = hints[link_id]
+            x = max(min(x, mtx.get_w() - len(hint)), 0)
+            # don't leave half of a wide char behind
+            if x > 0 and mtx[x, y] is not None and mtx[x, y].char == '':
+                mtx[x-1, y] = mtx[x-1, y]._replace(char=' ')
+            for ch in hint[:mtx.get_w()]:
+                mtx[x, y] = elements.RichChar(ch, ['a', 'hint'])
+                x += 1
+            if x < mtx.get_w() and mtx[x, y] is not None and \
+               mtx[x, y].char == '':
+                mtx[x, y] = mtx[x, y]._replace(char=' ')
+
+    def idle(self):
+        """Do background work while waiting for input.
+
+        Highlights the code a screen above and below the visible region so
+        that it is ready when scrolled to. Returns False if there was
+        nothing left to do."""
+        key = (self.scroll, self.w, self.h)
+        if key == self.idle_key:
+            return False
+        self.idle_key = key
+        ybegin = max(self.scroll - self.h, 0)
+        yend = min(self.scroll + 2*self.h, self.mtx.get_h())
+        for y in range(ybegin, yend):
+            for x in range(self.mtx.get_w()):
+                cell = self.mtx[x, y]
+                if cell is not None and cell.src is not None:
+                    cell.src[0].highlight(cell)
+        return True
+
+    def show_hints(self):
+        """Enter link following mode, drawing hints over visible links."""
+        self.hinting = True
+        self.draw()
+
+    def hide_hints(self):
+        """Leave link following mode."""
+        self.hinting = False
+        self.idle_key = None
+        self.draw()
+
     def fix_scroll(self):
         """Check if the scroll is valid; if not, fix it."""
         max_yoff = self.mtx.get_h() - self.h
@@ -108,8 +292,17 @@ class Document:
     @scroll
     def scroll_bot(self):
         """Scroll to the bottom of the document."""
+        self.fill(None)
         self.scroll = self.mtx.get_h() - self.h
 
+def put_highlights(mtx):
+    """Apply syntax highlighting to the code cells in mtx."""
+    for y in range(mtx.get_h()):
+        for x in range(mtx.get_w()):
+            cell = mtx[x, y]
+            if cell is not None and cell.src is not None:
+                mtx[x, y] = cell.src[0].highlight(cell)
+
 doc_stack = []
 def current():
     """Return the current document."""
@@ -125,9 +318,13 @@ def load_text(text):
     current().hold(elements.DocHead(markdown.parse(text)))
 
 def load(path):
-    """Load document from file."""
-    with open(path) as fin:
-        load_text(fin.read())
+    """Load document from a (possibly compressed) file.
+
+    The file is read and parsed in chunks as the document is scrolled."""
+    global doc_stack
+    doc_stack.append(Document())
+    current().hold(elements.DocHead(markdown.HTMLNode('html', {}, [])),
+                   markdown.iter_chunks(path))
 
 def go_back():
     """Go back one document."""
@@ -12,8 +12,11 @@ import regex as re
 from math import ceil
 from hyperpage import settings
 from hyperpage import document
+from hyperpage import syntax
+from hyperpage import wrap
 
-RichChar = namedtuple('RichChar', ('char', 'attrs'))
+RichChar = namedtuple('RichChar', ('char', 'attrs', 'link', 'src'),
+                      defaults=(None, None))
 
 class Matrix(dict):
     """A 0,0-based matrix of unicode characters."""
@@ -41,6 +44,22 @@ class Matrix(dict):
     def add_rows(self, num):
         for _ in range(num):
             self.add_row()
+    def del_rows(self, num):
+        for _ in range(num):
+            self.del_row()
+
+    def get_rows(self, y0, y1):
+        """Get rows y0 (inclusive) to y1 (exclusive) as lists of cells."""
+        return [[self[x, y] for x in range(self.get_w())]
+                for y in range(y0, y1)]
+    def set_rows(self, y0, rows):
+        """Replace every row from y0 onwards with the given rows."""
+        height = self.get_h()
+        for y, row in enumerate(rows, y0):
+            for x, cell in enumerate(row):
+                self[x, y] = cell
+        if y0 + len(rows) < height:
+            self.del_rows(height - y0 - len(rows))
 
     def del_row(self):
         """Remove one row from the end of the matrix."""
@@ -61,6 +80,15 @@ class Matrix(dict):
     def append(self, other):
         """Append one matrix to the end of the other."""
         return self + other
+    def __iadd__(self, other):
+        """Append another matrix to the end of this one, in place."""
+        if self.get_w() != other.get_w():
+            raise RuntimeError('Cannot combine matrices of different widths!')
+        start_h = self.get_h()
+        for y in range(other.get_h()):
+            for x in range(other.get_w()):
+                self[x, start_h+y] = other[x, y]
+        return self
 
     def paste(self, other, x, y):
         """Paste smaller matrix at the given x, y position in this one."""
@@ -92,18 +120,32 @@ class DocHead:
     """The document head. Contains all other elements."""
     def __init__(self, tree):
         self.subs = []
+        self.extend(tree)
+
+    def extend(self, tree):
+        """Add the elements of another tree after the current ones."""
+        self.subs += self.convert(tree)
+
+    def convert(self, tree):
+        """Return the elements of a tree, without adding them."""
+        subs = []
         for branch in tree.data:
             if branch.__class__.__name__ == 'HTMLData':
                 raise RuntimeError('Unenclosed data not allowed at top level!')
             else:
                 if branch.tag not in tag_table:
                     raise RuntimeError('Unknown tag: {} !'.format(branch.tag))
-                self.subs.append(tag_table[branch.tag](branch))
+                subs.append(tag_table[branch.tag](branch))
+        return subs
 
-    def draw(self, width):
-        """Draw each sub-element with a blank line between them."""
+    def draw(self, width, start=0, end=None):
+        """Draw each sub-element with a blank line between them.
+
+        Only the sub-elements from index start up to end are drawn."""
+        if end is None:
+            end = len(self.subs)
         mtx = Matrix(width)
-        for sub in self.subs:
+        for sub in self.subs[start:end]:
             mtx += sub.draw(width)
             mtx.add_row()
         return mtx
@@ -120,61 +162,77 @@ def parse_rich_chars(tree, attr_stack=[],
         else:
             astack_copy = copy.copy(attr_stack)
             astack_copy.append(branch.tag)
-            chars += parse_rich_chars(
+            sub_chars = parse_rich_chars(
                 branch, astack_copy, replace_newlines)
             if branch.tag == 'a':
-                # is a link; add to link table
-                link_uid = document.current().links.add(branch.attrs['href'])
-                hint_stack = copy.copy(astack_copy)+['hint']
-                chars.append(RichChar(' ', astack_copy))
-                chars.append(RichChar('[', hint_stack))
-                for ch in link_uid:
-                    chars.append(RichChar(ch, hint_stack))
-                chars.append(RichChar(']', hint_stack))
+                # is a link; add to link table and tag its chars
+                link_id = document.current().links.add(branch.attrs['href'])
+                if not sub_chars:
+                    # leave room for a hint on links without text
+                    sub_chars = [RichChar(' ', astack_copy)]
+                sub_chars = [rch._replace(link=link_id) for rch in sub_chars]
+            chars += sub_chars
     return chars
 
+def parse_code_lines(tree, block, texts, attr_stack=[]):
+    """Split preformatted text into lines of RichChars.
+
+    Each char records its source (block, line, column) so it can be
+    highlighted once it is about to be displayed. Chars from the same
+    piece of text share one attrs list. The raw text pieces are appended
+    to texts."""
+    lines = [[]]
+    def add(tree, attrs, link):
+        for branch in tree.data:
+            if branch.__class__.__name__ == 'HTMLData':
+                texts.append(branch.data)
+                line = lines[-1]
+                lineno = len(lines)-1
+                for ch in branch.data:
+                    if ch == '\n':
+                        line = []
+                        lines.append(line)
+                        lineno += 1
+                    else:
+                        line.append(RichChar(ch, attrs, link,
+                                             (block, lineno, len(line))))
+            else:
+                sub_link = link
+                if branch.tag == 'a':
+                    sub_link = document.current().links.add(
+                        branch.attrs['href'])
+                add(branch, attrs + [branch.tag], sub_link)
+    add(tree, attr_stack, None)
+    return lines
+
 class Par:
     """<p>...</p>"""
     def __init__(self, tree):
-        self.text = parse_rich_chars(tree)
+        self.text = wrap.Wrapper(parse_rich_chars(tree))
     def draw(self, width):
-        """Wraps text very roughly."""
+        """Word-wraps text."""
         mtx = Matrix(width)
-        offset = 0
-        while offset < len(self.text):
-            mtx.add_row(self.text[offset:offset+width])
-            offset += width
+        for row in self.text.wrap(width):
+            mtx.add_row(row)
         return mtx
 
 def Header(num):
     """Create a header (Hx) class."""
     class Hx(Par):
         def __init__(self, tree):
-            self.text = parse_rich_chars(tree, attr_stack=['h{}'.format(num)])
+            self.text = wrap.Wrapper(
+                parse_rich_chars(tree, attr_stack=['h{}'.format(num)]))
         def draw(self, width):
             center = 'center' in settings.render_attrs['h{}'.format(num)]
             if not center:
                 # Par left justifies
                 return super().draw(width)
-            else:
-                ljust_mtx = super().draw(width)
-                # collect all the (non-None) chars in the line.
-                # also empty the line as we go along.
-                y = ljust_mtx.get_h()-1
-                chars = []
-                for x in range(width):
-                    if ljust_mtx[x, y] is None:
-                        break
-                    chars.append(ljust_mtx[x, y])
-                    ljust_mtx[x, y] = None
-                # calculate centered offset
-                x_off = (width - len(chars))//2
-                # add centered chars
-                for x in range(x_off, x_off+len(chars)):
-                    ljust_mtx[x, y] = chars[x-x_off]
-            return ljust_mtx
-                
-                
+            mtx = Matrix(width)
+            for row in self.text.wrap(width):
+                # rows have one char per cell, so len(row) is the width
+                x_off = (width - len(row))//2
+                mtx.add_row([None]*x_off + row)
+            return mtx
     Hx.__doc__ = '<h{0}>...</h{0}>'.format(num)
     Hx.__name__ = 'h{}'.format(num)
     return Hx
@@ -183,24 +241,43 @@ H1, H2, H3, H4, H5, H6 = (Header(n) for n in range(1, 7))
 class CodeBlock:
     """<pre><code>...</code></pre>"""
     def __init__(self, tree):
-        text = parse_rich_chars(tree, replace_newlines=False)
-        self.lines = []
-        curr_start = 0
-        for here, rch in enumerate(text):
-            if rch.char == '\n':
-                self.lines.append(text[curr_start:here])
-                curr_start = here+1
-        self.lines.append(text[curr_start:])
+        texts = []
+        lines = parse_code_lines(tree, self, texts)
+        self.lexer = syntax.LineLexer(''.join(texts), code_lang(tree))
+        # the code ends with a newline; don't show an empty line after it
+        if len(lines) > 1 and not lines[-1]:
+            del lines[-1]
+        self.lines = [wrap.Wrapper(line, words=False) for line in lines]
+    def highlight(self, cell):
+        """Return cell (one of our chars) with its token attr added."""
+        _, lineno, col = cell.src
+        attr = self.lexer.attr_at(lineno, col)
+        if attr is None:
+            return cell
+        return cell._replace(attrs=cell.attrs+[attr])
     def draw(self, width):
-        """Wraps text very roughly."""
+        """Wraps each line wherever it reaches the width."""
         mtx = Matrix(width)
         for line in self.lines:
-            offset = 0
-            while offset < len(line):
-                mtx.add_row(line[offset:offset+width])
-                offset += width
+            rows = line.wrap(width)
+            if not rows:
+                # keep empty lines
+                mtx.add_row()
+            for row in rows:
+                mtx.add_row(row)
         return mtx
 
+def code_lang(tree):
+    """Get the info-string language of a code block, or None."""
+    for branch in tree.data:
+        if branch.__class__.__name__ == 'HTMLData' or branch.tag != 'code':
+            continue
+        for cls in (branch.attrs.get('class') or '').split():
+            for prefix in ('lang-', 'language-'):
+                if cls.startswith(prefix):
+                    return cls[len(prefix):]
+    return None
+
 class HRule:
     """<hr />"""
     def __init__(self, tree):
@@ -234,8 +311,8 @@ class List:
             self.items.append(Par(branch))
     def draw(self, width):
         labels = list(self.get_labels())
-        # find string length of largest label
-        req_len = max([len(lbl) for lbl in labels])
+        # find display width of largest label
+        req_len = max([wrap.text_width(lbl) for lbl in labels])
         par_wid = width-req_len
         mtx = Matrix(width)
         # add each item
@@ -0,0 +1,224 @@
+"""Cross-document index of a directory of markdown files.
+
+The index records the headings and local link targets of every markdown file
+under a root directory. It is stored on disk and updated incrementally: only
+files whose mtime changed since the last update are parsed again, in a pool
+of worker processes.
+
+Paths in the index are relative to the root and use '/' separators."""
+import json
+import lzma
+import os
+import os.path
+import posixpath
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, unquote
+from hyperpage import markdown
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_NAME = '.hyperpage-index.json'
+MARKDOWN_EXTS = tuple(ext + comp
+                      for ext in ('.md', '.markdown')
+                      for comp in ['']+list(markdown.openers))
+# below this many stale files, parsing in-process beats starting a pool
+MIN_POOL_FILES = 16
+
+def is_markdown(name):
+    """Check if a file name looks like a markdown file."""
+    return name.lower().endswith(MARKDOWN_EXTS)
+
+def walk(root):
+    """Yield the relative path of every markdown file under root.
+
+    Hidden files and directories are skipped."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if name.startswith('.') or not is_markdown(name):
+                continue
+            rel = os.path.relpath(os.path.join(dirpath, name), root)
+            yield rel.replace(os.sep, '/')
+
+def node_text(tree):
+    """Get the plain text contained in an HTML tree."""
+    if tree.__class__.__name__ == 'HTMLData':
+        return tree.data
+    return ''.join(node_text(branch) for branch in tree.data)
+
+def local_target(rel, href):
+    """Resolve a link in the file rel to a root-relative path.
+
+    Returns None for external links and links within the same page."""
+    parts = urlsplit(href)
+    if parts.scheme or parts.netloc or not parts.path:
+        return None
+    path = unquote(parts.path)
+    if path.startswith('/'):
+        return None
+    return posixpath.normpath(posixpath.join(posixpath.dirname(rel), path))
+
+def extract(tree, rel, headings, targets):
+    """Collect the headings and local link targets in an HTML tree."""
+    for branch in tree.data:
+        if branch.__class__.__name__ == 'HTMLData':
+            continue
+        if branch.tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+            headings.append([int(branch.tag[1]), node_text(branch).strip()])
+        elif branch.tag == 'a' and branch.attrs.get('href'):
+            target = local_target(rel, branch.attrs['href'])
+            if target is not None and target not in targets:
+                targets.append(target)
+        extract(branch, rel, headings, targets)
+
+def scan_file(root, rel):
+    """Parse one file; return its index entry [mtime, headings, targets].
+
+    Returns None if the file has disappeared. A file that cannot be read
+    or decoded gets an empty entry, so it is only retried once modified."""
+    path = os.path.join(root, rel)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    try:
+        with markdown.open_text(path) as fin:
+            text = fin.read()
+    except (OSError, UnicodeDecodeError, EOFError, lzma.LZMAError,
+            zlib.error):
+        return [mtime, [], []]
+    tree = markdown.parse(text)
+    headings, targets = [], []
+    extract(tree, rel, headings, targets)
+    return [mtime, headings, targets]
+
+def _scan_file(args):
+    """Pool entry point for scan_file."""
+    return scan_file(*args)
+
+class Index:
+    """The link graph and headings of all markdown files under a root."""
+    def __init__(self, root, path=None):
+        """Open the index of root, stored at path.
+
+        The stored index is read if it exists; call update() to bring it
+        up to date with the files on disk."""
+        self.root = os.path.abspath(root)
+        if path is None:
+            path = os.path.join(self.root, DEFAULT_INDEX_NAME)
+        self.path = path
+        self.files = {}
+        self.backrefs = None
+        if os.path.isfile(path):
+            self.read()
+
+    def read(self):
+        """Read the stored index, ignoring it if it is unusable."""
+        try:
+            with open(self.path) as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('version') == INDEX_VERSION \
+           and isinstance(data.get('files'), dict):
+            self.files = data['files']
+
+    def save(self):
+        """Write the index to disk."""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fout:
+            json.dump({'version': INDEX_VERSION, 'files': self.files},
+                      fout, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def update(self, workers=None):
+        """Re-parse new and modified files and forget deleted ones.
+
+        Workers is the size of the process pool (default: one per CPU).
+        Returns the number of files parsed."""
+        stale = []
+        present = set()
+        for rel in walk(self.root):
+            try:
+                mtime = os.stat(os.path.join(self.root, rel)).st_mtime
+            except OSError:
+                continue
+            present.add(rel)
+            if rel not in self.files or self.files[rel][0] != mtime:
+                stale.append(rel)
+        for rel in list(self.files):
+            if rel not in present:
+                del self.files[rel]
+        jobs = [(self.root, rel) for rel in stale]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if len(jobs) < MIN_POOL_FILES or workers == 1:
+            entries = map(_scan_file, jobs)
+            self.store(stale, entries)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(jobs)//(4*workers))
+                entries = pool.map(_scan_file, jobs, chunksize=chunksize)
+                self.store(stale, entries)
+        self.backrefs = None
+        return len(stale)
+
+    def store(self, rels, entries):
+        """Store freshly scanned entries, dropping files that vanished."""
+        for rel, entry in zip(rels, entries):
+            if entry is None:
+                self.files.pop(rel, None)
+            else:
+                self.files[rel] = entry
+
+    def headings(self, rel):
+        """Get the [level, text] headings of a file."""
+        if rel not in self.files:
+            return []
+        return self.files[rel][1]
+
+    def links(self, rel):
+        """Get the local link targets of a file."""
+        if rel not in self.files:
+            return []
+        return self.files[rel][2]
+
+    def resolve(self, target):
+        """Get the indexed file a link target refers to.
+
+        Like markdown.find_source, a target foo.md also matches foo.md.gz
+        and friends. Returns target itself if no indexed file matches."""
+        if target in self.files:
+            return target
+        for ext in markdown.openers:
+            if target + ext in self.files:
+                return target + ext
+        return target
+
+    def backlinks(self, rel):
+        """Get the files that link to the given file."""
+        if self.backrefs is None:
+            self.backrefs = {}
+            for src in sorted(self.files):
+                for target in self.files[src][2]:
+                    target = self.resolve(target)
+                    self.backrefs.setdefault(target, []).append(src)
+        return self.backrefs.get(rel, [])
+
+    def broken_links(self):
+        """Yield (file, target) for each link to a file that doesn't exist."""
+        for src in sorted(self.files):
+            for target in self.files[src][2]:
+                if self.resolve(target) in self.files:
+                    continue
+                path = os.path.join(self.root, target)
+                if not os.path.isdir(path) and \
+                   markdown.find_source(path) is None:
+                    yield src, target
+
+    def destinations(self):
+        """Yield (file, heading text or None) for every jump destination."""
+        for rel in sorted(self.files):
+            yield rel, None
+            for _, text in self.files[rel][1]:
+                yield rel, text
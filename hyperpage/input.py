@@ -1,6 +1,5 @@
 import copy
 import sys
-import os.path
 from curtsies import Input
 from hyperpage import display
 from hyperpage import markdown
@@ -42,25 +41,26 @@ class LinkHandler:
         self.backup_reg = copy.copy(hdl_reg)
         hdl_reg = self.FakeReg(self)
         self.growing_chain = ''
+        self.doc = document.current()
+        self.doc.show_hints()
         return self
     def __exit__(self, a, b, c):
         global hdl_reg
         hdl_reg = self.backup_reg
+        self.doc.hide_hints()
         return True
     def handle(self, k):
-        k = k.upper()
-        self.growing_chain += k
-        if k != 'Z':
-            # end of the chain
-            addr = document.current().links[self.growing_chain]
-            if addr is not None:
-                path = addr if os.path.isfile(addr) else None
-                if path is not None:
-                    document.load(path)
-            self.__exit__(None, None, None)
-        else:
+        self.growing_chain += k.upper()
+        if self.doc.links.is_prefix(self.growing_chain):
             # chain continues
-            pass
+            return
+        # end of the chain
+        addr = self.doc.links[self.growing_chain]
+        self.__exit__(None, None, None)
+        if addr is not None:
+            path = markdown.find_source(addr)
+            if path is not None:
+                document.load(path)
 link_handler = LinkHandler()
 
 def hdl_back(_):
@@ -92,6 +92,15 @@ def handle(inp):
     if inp in hdl_reg:
         hdl_reg[inp](inp)
 
+IDLE_TIMEOUT = 0.05
 def handle_next():
-    inp = inp_gen.next()
+    """Wait for and handle the next input, doing idle work meanwhile."""
+    while True:
+        inp = inp_gen.send(IDLE_TIMEOUT)
+        if inp is not None:
+            break
+        doc = document.current()
+        if doc is None or not doc.idle():
+            inp = inp_gen.next()
+            break
     handle(inp)
@@ -3,6 +3,11 @@ from mistune import markdown
 from html.parser import HTMLParser
 from html import unescape
 from collections import namedtuple
+import bz2
+import gzip
+import lzma
+import os.path
+import regex as re
 from hyperpage import elements
 
 HTMLDataNT = namedtuple('HTMLData', ('data',))
@@ -37,6 +42,127 @@ def parse(text):
     return html
 
 def load(path):
-    """Load a markdown file from a path."""
-    with open(path) as fin:
+    """Load a (possibly compressed) markdown file from a path."""
+    with open_text(path) as fin:
         return elements.DocHead(parse(fin.read()))
+
+openers = {
+    '.gz' : gzip.open,
+    '.xz' : lzma.open,
+    '.bz2' : bz2.open
+    }
+
+def open_text(path):
+    """Open a text file for reading, decompressing it by its extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in openers:
+        return openers[ext](path, 'rt')
+    return open(path)
+
+def find_source(path):
+    """Find the file to read for path.
+
+    That is path itself, or else a compressed version of it (path.gz, ...).
+    Returns None if there is neither."""
+    if os.path.isfile(path):
+        return path
+    for ext in openers:
+        if os.path.isfile(path + ext):
+            return path + ext
+    return None
+
+CHUNK_SIZE = 16384
+fence_re = re.compile(r' {0,3}(`{3,}|~{3,})')
+continuation_re = re.compile(r'[\s>]|[-*+]\s|\d+[.)]\s')
+# a whole-line link definition, by the same rule as mistune's def_links
+definition_re = re.compile(r' {0,3}\[([^^\]]+)\]: *<?[^\s>]+>?'
+                           r'(?: +["(][^\n]+[")])? *\n?$')
+
+# the start of a block of raw HTML, by the same rule as mistune's block_html
+inline_tags = ('a', 'em', 'strong', 'small', 's', 'cite', 'q', 'dfn', 'abbr',
+               'data', 'time', 'code', 'var', 'samp', 'kbd', 'sub', 'sup',
+               'i', 'b', 'u', 'mark', 'ruby', 'rt', 'rp', 'bdi', 'bdo', 'span',
+               'br', 'wbr', 'ins', 'del', 'img', 'font')
+void_tags = ('area', 'base', 'col', 'embed', 'hr', 'input', 'link', 'meta',
+             'param', 'source', 'track')
+html_re = re.compile(r' *<(?:(!--)|(?!(?:{})\b)(\w+)(?!:/|[^\w\s@]*@)\b)'
+                     .format('|'.join(inline_tags)))
+
+def html_end(line):
+    """Get what ends the raw HTML block starting on line.
+
+    Returns None if line does not start one, or if it ends on this line."""
+    match = html_re.match(line)
+    if match is None:
+        return None
+    if match.group(1):
+        end = '-->'
+    elif match.group(2).lower() in void_tags or \
+         line.rstrip().endswith('/>'):
+        return None
+    else:
+        end = '</{}>'.format(match.group(2).lower())
+    if end in line[match.end():].lower():
+        return None
+    return end
+
+label_re = re.compile(r'\[([^\[\]]+)\]')
+
+def link_key(label):
+    """Normalize a link label the way mistune does for lookups."""
+    return ' '.join(label.lower().split())
+
+def ref_labels(text):
+    """Get the keys of every bracketed label in text.
+
+    This includes every label a reference-style link in text could use."""
+    return set(link_key(label) for label in label_re.findall(text))
+
+def iter_chunks(path, size=CHUNK_SIZE):
+    """Read a (possibly compressed) markdown file in pieces.
+
+    Yields (text, defs) tuples. Each text is roughly size characters or
+    more, ending at a point where one block ends and an unrelated one
+    begins, so pieces can be parsed separately. Defs lists the
+    (label, line) reference-style link definitions found in the piece,
+    which the other pieces need in order to resolve their links. The file
+    is decompressed as it is read."""
+    with open_text(path) as fin:
+        chunk = []
+        defs = []
+        length = 0
+        fence = None
+        html = None
+        after_blank = False
+        for line in fin:
+            if (after_blank and fence is None and html is None and
+                length >= size and not continuation_re.match(line)):
+                yield ''.join(chunk), defs
+                chunk = []
+                defs = []
+                length = 0
+            chunk.append(line)
+            length += len(line)
+            after_blank = not line.strip()
+            # track raw HTML and fenced code, which may contain blank lines
+            if html is not None:
+                if html in line.lower():
+                    html = None
+                continue
+            match = fence_re.match(line)
+            if match is None:
+                if fence is None:
+                    html = html_end(line)
+                    match = definition_re.match(line)
+                    if match is not None:
+                        defs.append((link_key(match.group(1)),
+                                     line.rstrip('\n') + '\n'))
+                continue
+            marker = match.group(1)
+            if fence is None:
+                fence = marker
+            elif (marker[0] == fence[0] and len(marker) >= len(fence) and
+                  not line[match.end():].strip()):
+                fence = None
+        if chunk:
+            yield ''.join(chunk), defs
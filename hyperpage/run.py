@@ -2,6 +2,7 @@ from hyperpage import display
 from hyperpage import input
 from hyperpage import settings
 from hyperpage import document
+from hyperpage import markdown
 import argparse
 import sys
 import os.path
@@ -12,6 +13,13 @@ def valid_file(s):
             'File \'{}\' is not a valid file.'.format(s))
     return s
 
+def valid_doc(s):
+    path = markdown.find_source(s)
+    if path is None:
+        raise argparse.ArgumentTypeError(
+            'File \'{}\' is not a valid file.'.format(s))
+    return path
+
 DEFAULT_CONFIG_PATH = '~/.config/hyperpage/hyperpage.ini'
 
 class GenerateINI(argparse.Action):
@@ -26,8 +34,9 @@ def main():
     parser = argparse.ArgumentParser(
         description='Display markdown files in the terminal.')
     parser.add_argument('file', metavar='file.md',
-                        type=valid_file, default=None,
-                        help='The initial file to be opened.')
+                        type=valid_doc, default=None,
+                        help=('The initial file to be opened. It may be '
+                              'compressed (.gz, .xz or .bz2).'))
     parser.add_argument('-c', '--config', metavar='config.ini',
                         type=valid_file, default=None,
                         help=('The config file to use. If unspecified, '
@@ -15,6 +15,13 @@ h2 = bold blue
 h3 = bold green
 a = underline blue
 hint = on_red
+hint_chars = ASDFGHJKL
+keyword = bold magenta
+string = green
+number = cyan
+comment = dark
+builtin = cyan
+function = bold
 
 # unused:
 # h4, h5, h6
@@ -25,6 +32,7 @@ hint = on_red
 
 style_attrs = dict()
 render_attrs = defaultdict(list)
+hint_chars = 'ASDFGHJKL'
 
 def parse_ini(text):
     """Parse INI text into a dict."""
@@ -53,7 +61,11 @@ def init(path=None):
 
 def rasterize_config(config):
     """Fill the settings dicts according to the string-based config dict."""
+    global hint_chars
     for key in config:
+        if key == 'hint_chars':
+            hint_chars = parse_hint_chars(config[key])
+            continue
         stylestrs = select_stylestrs(config[key])
         renderstrs = select_renderstrs(config[key])
         if stylestrs:
@@ -61,6 +73,16 @@ def rasterize_config(config):
         if renderstrs:
             render_attrs[key] = renderstrs
 
+def parse_hint_chars(cfgstr):
+    """Parse the alphabet used for link hints."""
+    chars = ''
+    for ch in cfgstr.upper():
+        if not ch.isspace() and ch not in chars:
+            chars += ch
+    if len(chars) < 2:
+        raise RuntimeError('hint_chars needs at least two distinct keys!')
+    return chars
+
 def select_stylestrs(cfgstr):
     """Select the style strings from a space-separated config str."""
     stylestrs = []
@@ -0,0 +1,90 @@
+"""Lazy syntax highlighting of code blocks.
+
+Code is tokenized with pygments one line at a time, only as far as has been
+asked for, and the resulting token runs are kept so each line is only ever
+tokenized once."""
+from bisect import bisect_right
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+from pygments import token
+
+# token type -> attr; the first matching entry wins
+token_attrs = (
+    (token.Comment, 'comment'),
+    (token.Keyword, 'keyword'),
+    (token.String, 'string'),
+    (token.Number, 'number'),
+    (token.Name.Builtin, 'builtin'),
+    (token.Name.Function, 'function'),
+    (token.Name.Class, 'function'),
+    )
+
+def token_attr(ttype):
+    """Get the attr used to style a token type, or None."""
+    for parent, attr in token_attrs:
+        if ttype in parent:
+            return attr
+    return None
+
+def tokenize(code, lang):
+    """Return a token generator for code in the given language.
+
+    Returns None if the language is unknown."""
+    if lang is None:
+        return None
+    try:
+        lexer = get_lexer_by_name(lang, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return None
+    return lexer.get_tokens(code)
+
+class LineLexer:
+    """Incrementally tokenize code, caching the token runs of each line."""
+    def __init__(self, code, lang):
+        """Prepare to tokenize code. No work is done until it is needed."""
+        self.code = code
+        self.lang = lang
+        self.tokens = None
+        self.done = False
+        # runs of each line as (end, start, attr); the last one is partial
+        self.runs = [[]]
+        self.col = 0
+
+    def ready(self):
+        """Get the number of fully tokenized lines."""
+        if self.done:
+            return len(self.runs)
+        return len(self.runs)-1
+
+    def lex_to(self, lineno):
+        """Tokenize until the given line is complete (or the code ends)."""
+        if self.tokens is None and not self.done:
+            self.tokens = tokenize(self.code, self.lang)
+            if self.tokens is None:
+                self.done = True
+        while self.ready() <= lineno and not self.done:
+            tok = next(self.tokens, None)
+            if tok is None:
+                self.done = True
+                break
+            ttype, value = tok
+            attr = token_attr(ttype)
+            for num, part in enumerate(value.split('\n')):
+                if num > 0:
+                    self.runs.append([])
+                    self.col = 0
+                start = self.col
+                self.col += len(part)
+                if part and attr is not None:
+                    self.runs[-1].append((self.col, start, attr))
+
+    def attr_at(self, lineno, col):
+        """Get the token attr at the given line and column, or None."""
+        self.lex_to(lineno)
+        if lineno >= self.ready():
+            return None
+        runs = self.runs[lineno]
+        idx = bisect_right(runs, (col, float('inf')))
+        if idx < len(runs) and runs[idx][1] <= col:
+            return runs[idx][2]
+        return None
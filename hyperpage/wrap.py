@@ -0,0 +1,135 @@
+"""Wrapping of RichChar text to a width.
+
+The display width of every character and the places where lines may break
+are worked out once, when a block is parsed. Wrapping to any width is then a
+single pass over the precomputed pieces, so resizing stays cheap.
+
+Rows produced by wrapping have exactly one RichChar per terminal cell:
+combining marks are merged into the char they combine with, and a wide
+(East Asian) char is followed by an empty filler char."""
+import unicodedata
+
+# whitespace a line may break at; unlike str.isspace() this leaves out the
+# no-break spaces (U+00A0, U+2007, U+202F), which exist to prevent breaks
+breakable_spaces = frozenset(
+    ' \t\n\r\f\v\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006'
+    '\u2008\u2009\u200a\u205f\u3000')
+
+def char_width(ch):
+    """Get the number of terminal cells a character takes up."""
+    if ch < '\u0300':
+        # fast path: nothing below the combining diacritics is special
+        return 1
+    if unicodedata.combining(ch) or \
+       unicodedata.category(ch) in ('Mn', 'Me', 'Cf'):
+        return 0
+    if unicodedata.east_asian_width(ch) in ('W', 'F'):
+        return 2
+    return 1
+
+def text_width(text):
+    """Get the number of terminal cells a string takes up."""
+    return sum(char_width(ch) for ch in text)
+
+class Wrapper:
+    """A run of RichChars with precomputed widths and break opportunities."""
+    def __init__(self, chars, words=True):
+        """Prepare chars for wrapping.
+
+        If words is true, lines break between words (and around wide
+        chars) and the spaces at a break are dropped. Otherwise lines may
+        break between any two chars and all spaces are kept."""
+        self.cells = []
+        self.widths = []
+        for rch in chars:
+            width = char_width(rch.char)
+            if width == 0 and self.cells:
+                last = self.cells[-1]
+                self.cells[-1] = last._replace(char=last.char+rch.char)
+                continue
+            self.cells.append(rch)
+            self.widths.append(max(width, 1))
+        # pieces as (start, word end, end, word width, space width);
+        # lines may break before any piece. Without words, lines may break
+        # before any cell and there is no need for pieces.
+        self.pieces = None
+        if not words:
+            return
+        self.pieces = []
+        num = len(self.cells)
+        i = 0
+        while i < num:
+            start = i
+            if self.widths[i] == 2:
+                i += 1
+            else:
+                while i < num and self.widths[i] == 1 and \
+                      self.cells[i].char not in breakable_spaces:
+                    i += 1
+            word_end = i
+            while i < num and self.cells[i].char in breakable_spaces:
+                i += 1
+            self.pieces.append((start, word_end, i,
+                                sum(self.widths[start:word_end]),
+                                sum(self.widths[word_end:i])))
+
+    def put(self, row, i, width):
+        """Add cell i to row; return the number of cells used."""
+        cell = self.cells[i]
+        if self.widths[i] > width:
+            # a wide char on a one-cell line; show that something is there
+            row.append(cell._replace(char='?'))
+            return 1
+        row.append(cell)
+        if self.widths[i] == 2:
+            row.append(cell._replace(char=''))
+        return self.widths[i]
+
+    def wrap(self, width):
+        """Wrap to the given width; return a list of rows of RichChars.
+
+        Spaces at the end of a row are dropped, so len(row) is the width
+        of the visible text."""
+        rows = []
+        row = []
+        used = 0
+        if self.pieces is None:
+            for i in range(len(self.cells)):
+                if row and used + self.widths[i] > width:
+                    rows.append(row)
+                    row = []
+                    used = 0
+                used += self.put(row, i, width)
+            if row:
+                rows.append(row)
+            return rows
+        # spaces before the next word; only shown if it joins this row
+        spaces = range(0)
+        spaces_w = 0
+        for start, word_end, end, word_w, space_w in self.pieces:
+            if used + spaces_w + word_w > width:
+                # the word doesn't fit after the spaces; drop them and
+                # start a new row (unless this one is still empty)
+                if row:
+                    rows.append(row)
+                    row = []
+                    used = 0
+            else:
+                for i in spaces:
+                    used += self.put(row, i, width)
+            if word_w <= width:
+                for i in range(start, word_end):
+                    used += self.put(row, i, width)
+            else:
+                # longer than a whole line; break it wherever it must
+                for i in range(start, word_end):
+                    if row and used + self.widths[i] > width:
+                        rows.append(row)
+                        row = []
+                        used = 0
+                    used += self.put(row, i, width)
+            spaces = range(word_end, end)
+            spaces_w = space_w
+        if row:
+            rows.append(row)
+        return rows
@@ -4,7 +4,8 @@ setup(
     name="HyperPage",
     version="0.1.0",
     packages=['hyperpage'],
-    install_requires=['curtsies>=0.2.10', 'mistune>=0.7.2'],
+    install_requires=['curtsies>=0.2.10', 'mistune>=0.7.2',
+                      'pygments>=2.0'],
     entry_points={
         'console_scripts' : ['hpage = hyperpage.run:main']},
 